@@ -1,5 +1,5 @@
 # SGU Monthly Attendance — Supabase Database Version (with Electives & Course Reports)
-# Requires: streamlit, supabase, pandas, xlsxwriter, plotly
+# Requires: streamlit, supabase, pandas, numpy, xlsxwriter, plotly
 # -----------------------------------------------------------------------------
 # Patched: Consolidated all recent features and fixes into a final, optimized single file.
 # Timestamp: 2025-09-16
@@ -9,11 +9,18 @@
 # -----------------------------------------------------------------------------
 
 import io
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+import httpx
+import numpy as np
 import pandas as pd
 import streamlit as st
-import plotly.express as px
-from supabase import create_client, Client
+import plotly.graph_objects as go
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import xlsxwriter
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from supabase import create_client, Client, PostgrestAPIError
 
 # ───────────────────────── App Config & Constants ─────────────────────────
 st.set_page_config(page_title="SGU Attendance (DB)", page_icon="📚", layout="wide")
@@ -22,8 +29,17 @@ APP_SUBTITLE = "Creative Minds"
 __version__ = "7.2"
 CLASS_CHOICES = ["First Year", "Second Year", "Third Year", "Fourth Year"]
 MONTH_NAMES = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]
+MONTH_NUM = {name: f"{i+1:02d}" for i, name in enumerate(MONTH_NAMES)}
 STATUS_LOCKED = "LOCKED"
 STATUS_DRAFT = "DRAFT"
+STATUS_DTYPE = pd.CategoricalDtype([STATUS_DRAFT, STATUS_LOCKED])
+STATUS_COLORS = {STATUS_LOCKED: "green", STATUS_DRAFT: "orange"}
+UPSERT_BATCH_SIZE = 500
+TRANSIENT_SQLSTATE_CLASSES = ('08', '40', '53', '57')  # connection, deadlock/serialization, resources, statement timeout
+STUDENTS_TEMPLATE_BYTES = b"student_id,PRN,name\nS001,1,John Doe\n"
+FACULTY_TEMPLATE_BYTES = b"faculty_id,name,phone_number\nF001,Dr. Alan Turing,9876543210\n"
+COURSES_TEMPLATE_BYTES = b"course_code,course_name,assigned_faculty_id\nCS101,Intro to Code,F001\n"
+EXCEL_HEADER_FORMAT = {'bold': True, 'text_wrap': True, 'valign': 'top', 'font_color': 'white', 'border': 1}
 
 # ───────────────────────── Supabase Connection ─────────────────────────
 @st.cache_resource(show_spinner="Connecting to the database...")
@@ -61,106 +77,231 @@ def log_action(user_id: str, action: str, details: dict):
     except Exception as e:
         print(f"Failed to log action: {e}")
 
-@st.cache_data(show_spinner="Fetching departments...")
+def _chunk(xs: list, n: int):
+    for i in range(0, len(xs), n): yield xs[i:i + n]
+
+class PartialWriteError(Exception):
+    """Raised by upsert_in_batches when some batches were committed before another one failed."""
+    def __init__(self, written: int, total: int, cause: Exception):
+        super().__init__(f"only {written} of {total} rows were written ({cause})")
+        self.written, self.total, self.cause = written, total, cause
+
+def _is_transient(exc: Exception) -> bool:
+    """Timeouts, dropped connections, 5xx responses and retryable SQLSTATEs; constraint/validation errors are not."""
+    if isinstance(exc, httpx.TransportError): return True
+    if isinstance(exc, PostgrestAPIError):
+        if isinstance(exc.code, int): return exc.code >= 500
+        return str(exc.code or '')[:2] in TRANSIENT_SQLSTATE_CLASSES
+    return False
+
+def upsert_in_batches(table: str, records: list, batch_size: int = UPSERT_BATCH_SIZE, max_workers: int = 4, returning: str = 'minimal'):
+    """Upserts records in fixed-size batches sent concurrently. Batch order does not matter since rows are keyed by their conflict columns.
+    Each batch is its own transaction: transient failures are retried once, and if any batch still fails after others
+    were committed a PartialWriteError is raised. `returning='minimal'` skips echoing the written rows back."""
+    def _send(batch): supabase.table(table).upsert(batch, returning=returning).execute()
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        futures = {ex.submit(_send, batch): batch for batch in _chunk(records, batch_size)}
+        failed = [(futures[f], f.exception()) for f in as_completed(futures) if f.exception() is not None]
+    written, error = len(records) - sum(len(batch) for batch, _ in failed), None
+    for batch, exc in failed:
+        if _is_transient(exc):
+            try: _send(batch); written += len(batch); continue
+            except Exception as retry_exc: exc = retry_exc
+        error = error or exc
+    if error is None: return
+    if written: raise PartialWriteError(written, len(records), error)
+    raise error
+
+def run_concurrently(*calls: tuple) -> list:
+    """Runs independent (fn, *args) calls on a thread pool and returns their results in call order."""
+    ctx = get_script_run_ctx()
+    def _run(call):
+        add_script_run_ctx(ctx=ctx)  # st.cache_data needs the script context; the calls themselves must not render UI
+        fn, *args = call
+        return fn(*args)
+    with ThreadPoolExecutor(max_workers=len(calls)) as ex:
+        return list(ex.map(_run, calls))
+
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Downcasts 64-bit numeric columns and categorises a fully known `status` column so cached frames stay small."""
+    for col in df.select_dtypes('int64').columns: df[col] = pd.to_numeric(df[col], downcast='integer')
+    for col in df.select_dtypes('float64').columns: df[col] = pd.to_numeric(df[col], downcast='float')
+    if 'status' in df.columns:
+        unknown = set(df['status'].dropna().unique()) - set(STATUS_DTYPE.categories)
+        if unknown: print(f"Unexpected status values {sorted(map(str, unknown))}; leaving `status` as stored.")
+        else: df['status'] = df['status'].astype(STATUS_DTYPE)
+    return df
+
+@st.cache_data(ttl=3600, show_spinner="Fetching departments...")
 def get_departments() -> list:
     try: return supabase.table('departments').select('id, name').execute().data or []
     except Exception as e: st.error(f"DB Error (get_departments): {e}"); return []
 
-@st.cache_data(show_spinner="Loading student roster...")
+@st.cache_data(show_spinner=False)
+def _fetch_roster(department_id: int, class_name: str, section: str) -> pd.DataFrame:
+    response = supabase.table('students').select('student_id, PRN, name').eq('department_id', department_id).eq('class_name', class_name).eq('section', section).eq('is_active', True).order('PRN').execute()
+    return compact_dtypes(pd.DataFrame(response.data))
+
 def load_roster(department_id: int, class_name: str, section: str) -> pd.DataFrame:
-    try:
-        response = supabase.table('students').select('*').eq('department_id', department_id).eq('class_name', class_name).eq('section', section).eq('is_active', True).order('PRN').execute()
-        return pd.DataFrame(response.data)
+    try: return _fetch_roster(department_id, class_name, section)
     except Exception as e: st.error(f"DB Error (load_roster): {e}"); return pd.DataFrame()
 
-@st.cache_data(show_spinner="Fetching courses...")
+@st.cache_data(show_spinner=False)
+def get_roster_options(department_id: int, class_name: str, section: str) -> dict:
+    """student_id -> "name (student_id)" label for a class roster, built once per class for the enrollment multiselects."""
+    roster = load_roster(department_id, class_name, section)
+    return {sid: f"{name} ({sid})" for sid, name in zip(roster['student_id'], roster['name'])} if not roster.empty else {}
+
+@st.cache_data(ttl=600, show_spinner="Fetching courses...")
 def get_courses(department_id: int, class_name: str, section: str) -> pd.DataFrame:
     try:
-        response = supabase.table('courses').select('*').eq('department_id', department_id).eq('class_name', class_name).eq('section', section).execute()
+        response = supabase.table('courses').select('course_code, course_name, department_id, class_name, section, assigned_faculty_id').eq('department_id', department_id).eq('class_name', class_name).eq('section', section).execute()
         return pd.DataFrame(response.data)
     except Exception as e: st.error(f"DB Error (get_courses): {e}"); return pd.DataFrame()
 
-@st.cache_data(show_spinner="Fetching sections...")
+@st.cache_data(ttl=600, show_spinner="Fetching sections...")
 def get_sections_for_class(department_id: int, class_name: str) -> list:
     try:
-        response = supabase.table('students').select('section').eq('department_id', department_id).eq('class_name', class_name).execute()
-        if response.data:
-            return sorted(list(set([item['section'] for item in response.data])))
-        return []
+        response = supabase.rpc('distinct_sections', {'p_dept': department_id, 'p_class': class_name}).execute()
+        return [sec for sec in (response.data or []) if sec]
     except Exception as e: st.error(f"DB Error (get_sections_for_class): {e}"); return []
 
-@st.cache_data(show_spinner="Fetching enrolled students...")
+@st.cache_data(show_spinner=False)
+def _fetch_enrolled_students(course: dict) -> list:
+    response = supabase.table('student_course_enrollment').select('student_id').eq('course_code', course['course_code']).eq('department_id', course['department_id']).eq('class_name', course['class_name']).eq('section', course['section']).execute()
+    return [item['student_id'] for item in response.data]
+
 def get_enrolled_students(course: dict) -> list:
-    try:
-        response = supabase.table('student_course_enrollment').select('student_id').eq('course_code', course['course_code']).eq('department_id', course['department_id']).eq('class_name', course['class_name']).eq('section', course['section']).execute()
-        return [item['student_id'] for item in response.data]
+    try: return _fetch_enrolled_students(course)
     except Exception as e: st.error(f"DB Error (get_enrolled_students): {e}"); return []
 
 def update_course_enrollment(course_details: dict, student_ids: list):
-    match_criteria = {'course_code': course_details['course_code'], 'department_id': course_details['department_id'], 'class_name': course_details['class_name'], 'section': course_details['section']}
-    supabase.table('student_course_enrollment').delete().match(match_criteria).execute()
-    if student_ids:
-        records = [{**match_criteria, 'student_id': sid} for sid in student_ids]
-        supabase.table('student_course_enrollment').insert(records).execute()
-    get_enrolled_students.clear()
+    """Replace the course's enrollment with `student_ids` atomically via the `set_enrollment` RPC."""
+    supabase.rpc('set_enrollment', {'p_course_code': course_details['course_code'], 'p_dept': course_details['department_id'], 'p_class': course_details['class_name'], 'p_section': course_details['section'], 'p_student_ids': list(student_ids)}).execute()
+    invalidate('enrollment')
 
 @st.cache_data(show_spinner="Authenticating faculty...")
 def authenticate_faculty(faculty_id: str, pin: str):
     if not faculty_id or not pin or not pin.isdigit() or len(pin) != 4: return None
     try:
-        response = supabase.table('faculty').select('faculty_id, name, email, phone_number').eq('faculty_id', faculty_id).single().execute()
-        user_data = response.data
-        if user_data and user_data.get("phone_number"):
-            phone = str(user_data["phone_number"])
-            if len(phone) >= 4 and phone[-4:] == pin:
-                return {"FacultyID": user_data["faculty_id"], "Name": user_data["name"], "Email": user_data.get("email")}
+        response = supabase.rpc('verify_faculty_pin', {'p_fid': faculty_id, 'p_pin': pin}).execute()
+        if response.data:
+            user_data = response.data[0]
+            return {"FacultyID": user_data["faculty_id"], "Name": user_data["name"], "Email": user_data.get("email")}
         return None
     except Exception: return None
 
-@st.cache_data(show_spinner="Fetching faculty dashboard data...")
-def get_all_assigned_courses_for_faculty(faculty_id: str) -> pd.DataFrame:
-    try:
-        response = supabase.table('courses').select('*, departments!courses_department_id_fkey(name)').eq('assigned_faculty_id', faculty_id).execute()
-        df = pd.DataFrame(response.data)
-        if not df.empty and 'departments' in df.columns:
-            df['department_name'] = df['departments'].apply(lambda x: x.get('name', 'N/A') if isinstance(x, dict) else 'N/A')
-            df = df.drop(columns=['departments'])
-        return df
-    except Exception as e: st.error(f"DB Error (get_all_assigned_courses): {e}"); return pd.DataFrame()
-
-@st.cache_data(show_spinner="Fetching report statuses...")
-def get_attendance_status_summary(courses_df: pd.DataFrame) -> pd.DataFrame:
-    if courses_df.empty: return pd.DataFrame()
-    try:
-        response = supabase.table('attendance').select('course_code, department_id, class_name, section, month_yyyy_mm, status').in_('course_code', courses_df['course_code'].tolist()).in_('department_id', courses_df['department_id'].tolist()).in_('class_name', courses_df['class_name'].tolist()).in_('section', courses_df['section'].tolist()).execute()
-        return pd.DataFrame(response.data)
-    except Exception as e: st.error(f"DB Error (get_attendance_status_summary): {e}"); return pd.DataFrame()
+def get_attendance_data_version(month_keys: tuple):
+    """Latest attendance `updated_at` in these months; passed as a cache key so the dashboard refetches only after a write. Errors propagate."""
+    if not month_keys: return None
+    response = supabase.table('attendance').select('updated_at').in_('month_yyyy_mm', list(month_keys)).order('updated_at', desc=True, nullsfirst=False).limit(1).execute()
+    return response.data[0]['updated_at'] if response.data else None
+
+def fetch_faculty_dashboard(faculty_id: str, month_keys: tuple) -> pd.DataFrame:
+    """Assigned courses joined with their status for each of `month_keys`, in one `faculty_dashboard` RPC. Errors propagate."""
+    response = supabase.rpc('faculty_dashboard', {'p_fid': faculty_id, 'p_months': list(month_keys)}).execute()
+    return compact_dtypes(pd.DataFrame(response.data))
+
+@st.cache_data(ttl=600, max_entries=256, show_spinner="Fetching faculty dashboard data...")
+def get_faculty_dashboard(faculty_id: str, month_keys: tuple, data_version=None) -> pd.DataFrame:
+    return fetch_faculty_dashboard(faculty_id, month_keys)
 
-@st.cache_data(show_spinner="Fetching attendance records...")
+def load_faculty_dashboard(faculty_id: str, month_keys: tuple) -> pd.DataFrame:
+    """Dashboard cached on the attendance data version, or fetched uncached when the version can't be read."""
+    try: data_version = get_attendance_data_version(month_keys)
+    except Exception: return fetch_faculty_dashboard(faculty_id, month_keys)
+    return get_faculty_dashboard(faculty_id, month_keys, data_version)
+
+@st.cache_data(ttl=60, max_entries=64, show_spinner="Fetching attendance records...")
 def get_attendance_records(course_code: str, month_key: str, department_id: int, class_name: str, section: str) -> pd.DataFrame:
     try:
-        response = supabase.table('attendance').select('*').eq('course_code', course_code).eq('month_yyyy_mm', month_key).eq('department_id', department_id).eq('class_name', class_name).eq('section', section).execute()
-        return pd.DataFrame(response.data)
+        response = supabase.table('attendance').select('student_id, attended, lectures_held, status, remarks').eq('course_code', course_code).eq('month_yyyy_mm', month_key).eq('department_id', department_id).eq('class_name', class_name).eq('section', section).execute()
+        return compact_dtypes(pd.DataFrame(response.data))
     except Exception as e: st.error(f"DB Error (get_attendance_records): {e}"); return pd.DataFrame()
 
-def month_key(month_name: str, year=None) -> str:
-    year = year or datetime.now().year
-    month_map = {name: f"{i+1:02d}" for i, name in enumerate(MONTH_NAMES)}
-    return f"{year}{month_map.get(month_name, '01')}"
+# Report readers let errors propagate, so a failed fetch is never cached.
+@st.cache_data(ttl=600, max_entries=32, show_spinner=False)
+def get_class_report(department_id: int, class_name: str, section: str, month_key: str) -> tuple:
+    """Course-wise matrix and per-student totals for the admin class report."""
+    response = supabase.rpc('get_class_report', {'p_department_id': department_id, 'p_class_name': class_name, 'p_section': section, 'p_month_key': month_key}).execute()
+    df = pd.DataFrame(response.data)
+    if df.empty: return df, df
+    # Arrow strings go to st.dataframe without a conversion.
+    df = df.astype({col: pd.ArrowDtype(pa.string()) for col in ('student_id', 'PRN', 'name')})
+    cells = pd.DataFrame(df['courses'].tolist(), dtype=object)
+    cells = cells[sorted(cells.columns)]
+    pivot_df = pd.concat([df[['PRN', 'name']], cells.where(cells.notna(), '-')], axis=1)
+    totals_df = compact_dtypes(df[['student_id', 'PRN', 'name', 'total_held', 'total_attended']].copy()).assign(percent=pd.to_numeric(df['percent']))
+    return pivot_df, totals_df
+
+@st.cache_data(ttl=600, max_entries=32, show_spinner=False)
+def get_course_summary(department_id: int, class_name: str, section: str, month_key: str) -> pd.DataFrame:
+    """Average attendance per course for the Reports tab."""
+    response = supabase.rpc('get_course_wise_summary', {'p_department_id': department_id, 'p_class_name': class_name, 'p_section': section, 'p_month_key': month_key}).select('course_name, average_attendance').execute()
+    df = pd.DataFrame(response.data)
+    if not df.empty: df['average_attendance'] = pd.to_numeric(df['average_attendance'])
+    return df
+
+@st.cache_data(ttl=600, max_entries=32, show_spinner=False)
+def get_class_history(department_id: int, class_name: str, section: str) -> pd.DataFrame:
+    """Per-student monthly attendance percent for the Reports charts."""
+    response = supabase.rpc('get_full_class_history', {'p_department_id': department_id, 'p_class_name': class_name, 'p_section': section}).select('name, month_yyyy_mm, attendance_percent').execute()
+    df = pd.DataFrame(response.data)
+    if not df.empty: df['attendance_percent'] = pd.to_numeric(df['attendance_percent'])
+    return df
+
+@st.cache_resource(ttl=600, max_entries=32, show_spinner=False)
+def get_class_history_index(department_id: int, class_name: str, section: str) -> dict:
+    """Class history split by student and by month; shared across sessions, so read-only."""
+    df = get_class_history(department_id, class_name, section)
+    if df.empty: return {'by_name': {}, 'by_month': {}}
+    return {'by_name': {name: g.sort_values('month_yyyy_mm', kind='stable') for name, g in df.groupby('name')},
+            'by_month': dict(tuple(df.groupby('month_yyyy_mm')))}
 
+def month_key(month_name: str, year=None) -> str:
+    return f"{year or datetime.now().year}{MONTH_NUM.get(month_name, '01')}"
+
+def get_recent_months(count: int = 3) -> list:
+    """Display names and month keys for the current month and the `count - 1` months before it."""
+    today = datetime.now()
+    months = []
+    for i in range(count):
+        name, year = MONTH_NAMES[(today.month - 1 - i) % 12], (today.year if today.month > i else today.year - 1)
+        months.append({"display_name": f"{name} {year}", "month_yyyy_mm": month_key(name, year)})
+    return months
+
+# Keyed on the frame's content, so reruns reuse the bytes.
+@st.cache_data(ttl=600, max_entries=32, show_spinner=False)
 def export_excel_file(df: pd.DataFrame, title: str, sheet_name: str, color: str) -> bytes:
     output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name=sheet_name)
-        workbook = writer.book
-        worksheet = writer.sheets[sheet_name]
-        header_format = workbook.add_format({'bold': True, 'text_wrap': True, 'valign': 'top', 'fg_color': color, 'font_color': 'white', 'border': 1})
-        for col_num, value in enumerate(df.columns.values):
-            worksheet.write(0, col_num, value, header_format)
-        worksheet.autofit()
-    output.seek(0)
+    # constant_memory: rows must be written in order.
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'strings_to_urls': False})
+    worksheet = workbook.add_worksheet(sheet_name)
+    header_format = workbook.add_format({**EXCEL_HEADER_FORMAT, 'fg_color': color})
+    widths = df.astype(str).agg(lambda col: col.map(len).max()) if not df.empty else pd.Series(0, index=df.columns)
+    for col_num, (name, width) in enumerate(zip(df.columns, widths)):
+        worksheet.set_column(col_num, col_num, min(max(int(width), len(str(name))) + 2, 40))
+    worksheet.write_row(0, 0, [str(c) for c in df.columns], header_format)
+    for row_num, row in enumerate(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None), start=1):
+        worksheet.write_row(row_num, 0, row)
+    workbook.close()
     return output.getvalue()
 
+# Cached readers grouped by the data they depend on; mutators call invalidate(<group>, ...) instead of
+# clearing individual functions, so a new reader only needs registering here.
+CACHE_GROUPS = {
+    'departments': [get_departments],
+    'students': [_fetch_roster, get_roster_options, get_sections_for_class],
+    'faculty': [authenticate_faculty],
+    'courses': [get_courses, get_faculty_dashboard],
+    'enrollment': [_fetch_enrolled_students],
+    'attendance': [get_attendance_records, get_class_report, get_course_summary, get_class_history, get_class_history_index],
+}
+
+def invalidate(*groups: str):
+    for group in groups:
+        for fn in CACHE_GROUPS[group]: fn.clear()
+
 # ───────────────────────── UI Rendering ─────────────────────────
 st.markdown(f"## {APP_TITLE}"); st.caption(f"{APP_SUBTITLE} | v{__version__}"); st.divider()
 
@@ -225,54 +366,56 @@ with tab_entry:
 
         if st.session_state.faculty_course_selection is None:
             st.markdown("#### Your Assigned Courses Dashboard")
-            courses_df = get_all_assigned_courses_for_faculty(identity['FacultyID'])
-            if courses_df.empty:
-                st.warning("You have no courses assigned. Please contact an administrator.")
+            recent_months = get_recent_months()
+            recent_keys = tuple(m['month_yyyy_mm'] for m in recent_months)
+            try: dashboard_df = load_faculty_dashboard(identity['FacultyID'], recent_keys)
+            except Exception as e: st.error(f"DB Error (faculty_dashboard): {e}")
             else:
-                status_df = get_attendance_status_summary(courses_df)
-                today = datetime.now()
-                recent_months = [{"display_name": f"{MONTH_NAMES[(today.month - 1 - i) % 12]} {(today.year if today.month > i else today.year - 1)}", "month_yyyy_mm": month_key(MONTH_NAMES[(today.month - 1 - i) % 12], (today.year if today.month > i else today.year - 1))} for i in range(3)]
-                
-                merged_df = courses_df.copy()
-                if not status_df.empty:
-                    merged_df = pd.merge(courses_df, status_df, on=['course_code', 'department_id', 'class_name', 'section'], how='left')
+                if dashboard_df.empty:
+                    st.warning("You have no courses assigned. Please contact an administrator.")
                 else:
-                    merged_df['month_yyyy_mm'] = None; merged_df['status'] = None
-
-                for _, course_row in courses_df.iterrows():
-                    with st.container(border=True):
-                        st.subheader(f"{course_row['course_name']} ({course_row['course_code']})")
-                        st.caption(f"{course_row['department_name']} — {course_row['class_name']} / {course_row['section']}")
-                        stat_cols = st.columns(len(recent_months))
-                        for i, month_info in enumerate(recent_months):
-                            with stat_cols[i]:
-                                entry = merged_df[(merged_df['course_code'] == course_row['course_code']) & (merged_df['section'] == course_row['section']) & (merged_df['month_yyyy_mm'] == month_info['month_yyyy_mm'])]
-                                status = entry['status'].iloc[0] if not entry.empty and pd.notna(entry['status'].iloc[0]) else "Not Started"
-                                color = {STATUS_LOCKED: "green", STATUS_DRAFT: "orange"}.get(status, "grey")
-                                st.caption(month_info['display_name'])
-                                st.markdown(f"**:{color}[{status}]**")
-                        if st.button("Enter / Edit Attendance", key=f"entry_{course_row['course_code']}_{course_row['section']}"):
-                            st.session_state.faculty_course_selection = course_row.to_dict(); st.rerun()
+                    courses_df = dashboard_df.drop_duplicates(subset=['course_code', 'department_id', 'class_name', 'section'])[['course_code', 'course_name', 'department_id', 'department_name', 'class_name', 'section']]
+                    status_df = dashboard_df.dropna(subset=['month_yyyy_mm'])
+                    status_map = dict(zip(zip(status_df['course_code'], status_df['department_id'], status_df['class_name'], status_df['section'], status_df['month_yyyy_mm']), status_df['status']))
+
+                    for course_row in courses_df.itertuples(index=False):
+                        with st.container(border=True):
+                            st.subheader(f"{course_row.course_name} ({course_row.course_code})")
+                            st.caption(f"{course_row.department_name} — {course_row.class_name} / {course_row.section}")
+                            stat_cols = st.columns(len(recent_months))
+                            for i, month_info in enumerate(recent_months):
+                                with stat_cols[i]:
+                                    status = status_map.get((course_row.course_code, course_row.department_id, course_row.class_name, course_row.section, month_info['month_yyyy_mm']))
+                                    status = status if pd.notna(status) else "Not Started"
+                                    color = STATUS_COLORS.get(status, "grey")
+                                    st.caption(month_info['display_name'])
+                                    st.markdown(f"**:{color}[{status}]**")
+                            if st.button("Enter / Edit Attendance", key=f"entry_{course_row.course_code}_{course_row.department_id}_{course_row.class_name}_{course_row.section}"):
+                                st.session_state.faculty_course_selection = course_row._asdict(); st.rerun()
         else:
             course = st.session_state.faculty_course_selection
             st.subheader(f"📝 Attendance Entry: {course['course_name']}")
             if st.button("‹ Back to Dashboard"):
                 st.session_state.faculty_course_selection = None; st.rerun()
             
-            roster_df = load_roster(course['department_id'], course['class_name'], course['section'])
+            # Workers only call the raw cached fetchers; the spinner and any error are rendered here on the script thread.
+            try:
+                with st.spinner("Loading course roster..."):
+                    roster_df, enrolled_ids = run_concurrently((_fetch_roster, course['department_id'], course['class_name'], course['section']), (_fetch_enrolled_students, course))
+            except Exception as e:
+                st.error(f"DB Error (course roster): {e}"); roster_df, enrolled_ids = pd.DataFrame(), []
             if not roster_df.empty:
                 with st.expander("🪢 Manage Enrollment for this Course"):
-                    enrolled_ids = get_enrolled_students(course)
-                    options = roster_df.set_index('student_id')['name'].to_dict()
-                    selected_ids = st.multiselect("Enrolled Students", options.keys(), default=enrolled_ids, format_func=lambda id: f"{options.get(id, 'Unknown')} ({id})", key=f"faculty_enroll_{course['course_code']}")
+                    id_to_label = get_roster_options(course['department_id'], course['class_name'], course['section'])
+                    selected_ids = st.multiselect("Enrolled Students", id_to_label.keys(), default=enrolled_ids, format_func=lambda id: id_to_label.get(id, f"Unknown ({id})"), key=f"faculty_enroll_{course['course_code']}")
                     if st.button("Update Enrollment", key=f"update_enroll_{course['course_code']}"):
                         try:
                             update_course_enrollment(course, selected_ids)
+                            enrolled_ids = selected_ids
                             st.toast("✅ Enrollment updated successfully!")
                         except Exception as e: st.error(f"Error updating enrollment: {e}")
 
-                enrolled_ids = get_enrolled_students(course)
-                students_to_show = roster_df[roster_df['student_id'].isin(enrolled_ids)].copy() if enrolled_ids else roster_df.copy()
+                students_to_show = roster_df[roster_df['student_id'].isin(enrolled_ids)] if enrolled_ids else roster_df
                 if not students_to_show.empty:
                     c1, c2 = st.columns(2)
                     month_name = c1.selectbox("Month", MONTH_NAMES, index=datetime.now().month - 1)
@@ -283,15 +426,14 @@ with tab_entry:
                     entry_df['LecturesHeld'] = lectures_held
                     entry_df['Attended'] = 0; entry_df['Status'] = STATUS_DRAFT; entry_df['Remarks'] = ''
                     if not attendance_df.empty:
-                        db_vals = attendance_df.rename(columns={'student_id': 'StudentID', 'attended': 'Attended', 'lectures_held': 'LecturesHeld', 'status': 'Status', 'remarks': 'Remarks'})
-                        entry_df = entry_df.merge(db_vals[['StudentID', 'Attended', 'LecturesHeld', 'Status', 'Remarks']], on='StudentID', how='left', suffixes=('', '_db'))
+                        db_idx = attendance_df.rename(columns={'student_id': 'StudentID', 'attended': 'Attended', 'lectures_held': 'LecturesHeld', 'status': 'Status', 'remarks': 'Remarks'}).set_index('StudentID')
                         for col in ['Attended', 'LecturesHeld', 'Status', 'Remarks']:
-                            entry_df[col] = entry_df[f'{col}_db'].fillna(entry_df[col])
-                            if col in ['Attended', 'LecturesHeld']: entry_df[col] = pd.to_numeric(entry_df[col], errors='coerce').fillna(0).astype(int)
-                        entry_df.drop(columns=[c for c in entry_df.columns if '_db' in c], inplace=True)
+                            entry_df[col] = entry_df['StudentID'].map(db_idx[col]).fillna(entry_df[col])
+                        entry_df[['Attended', 'LecturesHeld']] = entry_df[['Attended', 'LecturesHeld']].apply(pd.to_numeric, errors='coerce').fillna(0).astype('int32')
                     
-                    entry_df['Percentage'] = entry_df.apply(lambda r: (r['Attended'] / r['LecturesHeld'] * 100) if r['LecturesHeld'] > 0 else 0, axis=1)
-                    is_locked = STATUS_LOCKED in entry_df['Status'].unique()
+                    held = entry_df['LecturesHeld'].to_numpy(); att = entry_df['Attended'].to_numpy()
+                    entry_df['Percentage'] = np.where(held > 0, att / np.where(held > 0, held, 1) * 100.0, 0.0)
+                    is_locked = bool((entry_df['Status'].to_numpy() == STATUS_LOCKED).any())
                     df_for_display = entry_df
                     
                     if not is_locked:
@@ -308,19 +450,24 @@ with tab_entry:
                             if cl2.button("Cancel", use_container_width=True): del st.session_state['confirm_lock']; st.rerun()
                         if 'status_to_set' in st.session_state:
                             status_to_set = st.session_state.pop('status_to_set')
-                            errors = [f"For **{r['Name']}**, attended ({r['Attended']}) cannot exceed lectures held ({r['LecturesHeld']})." for _, r in edited_df.iterrows() if r['Attended'] > r['LecturesHeld']]
+                            mask = edited_df['Attended'].to_numpy() > edited_df['LecturesHeld'].to_numpy()
+                            bad_rows = edited_df.loc[mask, ['Name', 'Attended', 'LecturesHeld']].itertuples(index=False)
+                            errors = [f"For **{n}**, attended ({a}) cannot exceed lectures held ({l})." for n, a, l in bad_rows]
                             if errors:
                                 for e in errors: st.warning(e)
                             else:
-                                upsert_data = [{'student_id': r['StudentID'], 'course_code': course['course_code'], 'department_id': course['department_id'], 'class_name': course['class_name'], 'section': course['section'], 'month_yyyy_mm': mk, 'lectures_held': r['LecturesHeld'], 'attended': r['Attended'], 'status': status_to_set, 'updated_by_faculty_id': identity['FacultyID'], 'remarks': r['Remarks'], 'updated_at': datetime.utcnow().isoformat()} for _, r in edited_df.iterrows()]
+                                fixed = {'course_code': course['course_code'], 'department_id': course['department_id'], 'class_name': course['class_name'], 'section': course['section'], 'month_yyyy_mm': mk, 'status': status_to_set, 'updated_by_faculty_id': identity['FacultyID'], 'updated_at': datetime.utcnow().isoformat()}
+                                records = edited_df[['StudentID', 'Attended', 'LecturesHeld', 'Remarks']].rename(columns={'StudentID': 'student_id', 'Attended': 'attended', 'LecturesHeld': 'lectures_held', 'Remarks': 'remarks'}).to_dict('records')
+                                upsert_data = [{**fixed, **r} for r in records]
                                 with st.spinner(f"Saving attendance as {status_to_set}..."):
                                     try:
-                                        supabase.table('attendance').upsert(upsert_data).execute()
+                                        upsert_in_batches('attendance', upsert_data)
                                         if status_to_set == STATUS_LOCKED:
                                             log_action(identity['FacultyID'], "LOCK_ATTENDANCE", {'course': course['course_code'], 'month': mk})
-                                        st.toast(f"Attendance saved as {status_to_set}!", icon="✅")
-                                        get_attendance_records.clear(); get_attendance_status_summary.clear(); st.rerun()
+                                        st.toast(f"Attendance saved as {status_to_set}!", icon="✅"); st.rerun()
+                                    except PartialWriteError as e: st.error(f"Partial save: {e}. Saving again is safe and will complete it.")
                                     except Exception as e: st.error(f"DB Error: {e}")
+                                    finally: invalidate('attendance')
                     else:
                         st.success("This month's attendance is LOCKED.")
                         st.dataframe(entry_df, use_container_width=True)
@@ -356,44 +503,44 @@ with tab_reports:
         rep_month_course = st.selectbox("Select Month", MONTH_NAMES, index=datetime.now().month-1, key="course_month_select")
         mk_course = month_key(rep_month_course)
         try:
-            response = supabase.rpc('get_course_wise_summary', {'p_department_id': class_config['department_id'], 'p_class_name': class_config['class_name'], 'p_section': class_config['section'], 'p_month_key': mk_course}).execute()
-            course_summary_df = pd.DataFrame(response.data)
+            course_summary_df = get_course_summary(class_config['department_id'], class_config['class_name'], class_config['section'], mk_course)
             if course_summary_df.empty:
                 st.warning(f"No attendance data for {rep_month_course} to generate course report.")
             else:
-                course_summary_df['average_attendance'] = pd.to_numeric(course_summary_df['average_attendance'])
-                fig = px.bar(course_summary_df, x='course_name', y='average_attendance', title=f"Average Attendance per Course for {rep_month_course}", labels={'course_name': 'Course', 'average_attendance': 'Average Attendance (%)'}, text='average_attendance')
-                fig.update_traces(texttemplate='%{text:.2f}%', textposition='outside'); fig.update_layout(yaxis_range=[0,100])
+                avg = course_summary_df['average_attendance'].to_numpy()
+                fig = go.Figure(go.Bar(x=course_summary_df['course_name'].to_numpy(), y=avg, text=avg, texttemplate='%{text:.2f}%', textposition='outside'))
+                fig.update_layout(title=f"Average Attendance per Course for {rep_month_course}", xaxis_title='Course', yaxis_title='Average Attendance (%)', yaxis_range=[0,100])
                 st.plotly_chart(fig, use_container_width=True)
         except Exception as e: st.error(f"Error generating course report: {e}")
         st.divider()
         st.markdown("### Student Performance")
         try:
-            response = supabase.rpc('get_full_class_history', {'p_department_id': class_config['department_id'], 'p_class_name': class_config['class_name'], 'p_section': class_config['section']}).execute()
-            history_df = pd.DataFrame(response.data)
-            if history_df.empty:
+            history = get_class_history_index(class_config['department_id'], class_config['class_name'], class_config['section'])
+            if not history['by_name']:
                 st.warning("No attendance history found for this class.")
             else:
-                history_df['attendance_percent'] = pd.to_numeric(history_df['attendance_percent'])
                 st.markdown("#### Student Attendance Trend Over Time")
-                student_list = sorted(history_df['name'].unique())
+                student_list = list(history['by_name'])
                 default_students = student_list[:3] if len(student_list) > 0 else []
                 selected_students = st.multiselect("Select students to compare:", student_list, default=default_students)
                 if selected_students:
-                    trend_df = history_df[history_df['name'].isin(selected_students)]
-                    fig_trend = px.line(trend_df, x='month_yyyy_mm', y='attendance_percent', color='name', markers=True, title="Monthly Attendance Percentage per Student", labels={'month_yyyy_mm': 'Month', 'attendance_percent': 'Attendance %', 'name': 'Student Name'})
+                    fig_trend = go.Figure()
+                    for name in selected_students:
+                        sub = history['by_name'][name]
+                        fig_trend.add_scatter(x=sub['month_yyyy_mm'].to_numpy(), y=sub['attendance_percent'].to_numpy(), mode='lines+markers', name=name)
+                    fig_trend.update_layout(title="Monthly Attendance Percentage per Student", xaxis_title='Month', yaxis_title='Attendance %', legend_title_text='Student Name')
                     st.plotly_chart(fig_trend, use_container_width=True)
                 st.divider()
                 st.markdown("#### Class Performance Distribution")
-                month_list = sorted(history_df['month_yyyy_mm'].unique())
+                month_list = list(history['by_month'])
                 sel_month_dist = st.selectbox("Select Month for Distribution Analysis:", month_list, index=len(month_list)-1 if month_list else 0)
                 if sel_month_dist:
-                    month_df = history_df[history_df['month_yyyy_mm'] == sel_month_dist]
+                    month_df = history['by_month'][sel_month_dist]
                     bins = [0, 50, 75, 101]; labels = ['Below 50% (High Risk)', '50% - 75% (At Risk)', 'Above 75% (Good Standing)']
-                    month_df['performance_category'] = pd.cut(month_df['attendance_percent'], bins=bins, labels=labels, right=False)
-                    performance_counts = month_df['performance_category'].value_counts().reset_index()
-                    performance_counts.columns = ['performance_category', 'count']
-                    fig_pie = px.pie(performance_counts, names='performance_category', values='count', title=f"Student Attendance Distribution for {sel_month_dist}", color='performance_category', color_discrete_map={'Below 50% (High Risk)': '#EF4444', '50% - 75% (At Risk)': '#F59E0B', 'Above 75% (Good Standing)': '#10B981'})
+                    counts, _ = np.histogram(month_df['attendance_percent'].to_numpy(), bins=bins)
+                    pie_colors = ['#EF4444', '#F59E0B', '#10B981']
+                    fig_pie = go.Figure(go.Pie(labels=labels, values=counts, marker_colors=pie_colors, sort=False))
+                    fig_pie.update_layout(title=f"Student Attendance Distribution for {sel_month_dist}")
                     st.plotly_chart(fig_pie, use_container_width=True)
         except Exception as e: st.error(f"An error occurred while generating student analytics: {e}")
 
@@ -414,11 +561,10 @@ with tab_admin:
                 if st.form_submit_button("Add Department"):
                     if new_dept_name:
                         try:
-                            supabase.table('departments').insert({"name": new_dept_name.strip()}).execute()
-                            st.toast(f"Added '{new_dept_name.strip()}'.", icon="✅"); get_departments.clear(); st.rerun()
-                        except Exception as e:
-                            if '23505' in str(e): st.warning(f"The department '{new_dept_name.strip()}' already exists.")
-                            else: st.error(f"Unexpected error: {e}")
+                            created = supabase.rpc('add_department', {'p_name': new_dept_name.strip()}).execute().data
+                            if created: st.toast(f"Added '{new_dept_name.strip()}'.", icon="✅"); invalidate('departments'); st.rerun()
+                            else: st.warning(f"The department '{new_dept_name.strip()}' already exists.")
+                        except Exception as e: st.error(f"Unexpected error: {e}")
                     else: st.warning("Please enter a department name.")
 
         with tab_class:
@@ -435,9 +581,11 @@ with tab_admin:
                         if all([new_sec_name, sel_dept_id, sel_class_name]):
                             try:
                                 sec_to_add = new_sec_name.strip()
-                                ph_id = f"{sel_class_name.replace(' ', '_').upper()}-{sec_to_add.upper()}_PLACEHOLDER"
-                                supabase.table('students').upsert({'student_id': ph_id, 'PRN': ph_id, 'name': 'Admin Placeholder', 'department_id': sel_dept_id, 'class_name': sel_class_name, 'section': sec_to_add, 'is_active': False}).execute()
-                                st.toast(f"Created section '{sec_to_add}'.", icon="✅"); get_sections_for_class.clear(); st.rerun()
+                                ph_id = f"D{sel_dept_id}-{sel_class_name.replace(' ', '_').upper()}-{sec_to_add.upper()}_PLACEHOLDER"
+                                result = supabase.rpc('add_section_placeholder', {'p_student_id': ph_id, 'p_dept': sel_dept_id, 'p_class': sel_class_name, 'p_section': sec_to_add}).execute().data
+                                if result == 'created': st.toast(f"Created section '{sec_to_add}'.", icon="✅"); invalidate('students'); st.rerun()
+                                elif result == 'exists': st.warning(f"The section '{sec_to_add}' already exists for {sel_class_name}.")
+                                else: st.error(f"Could not create the section: placeholder ID '{ph_id}' is already used by another student record.")
                             except Exception as e: st.error(f"Unexpected error: {e}")
                         else: st.warning("Please ensure all fields are filled.")
 
@@ -448,14 +596,15 @@ with tab_admin:
                 courses = get_courses(class_config['department_id'], class_config['class_name'], class_config['section'])
                 if courses.empty: st.warning("No courses found. Add them via Bulk Data.")
                 else:
-                    course = st.selectbox("Select Course for Enrollment", courses.to_dict('records'), format_func=lambda c: f"{c['course_name']} ({c['course_code']})")
+                    course_by_label = {f"{c['course_name']} ({c['course_code']})": c for c in courses.to_dict('records')}
+                    course = course_by_label[st.selectbox("Select Course for Enrollment", list(course_by_label))]
                     roster = load_roster(class_config['department_id'], class_config['class_name'], class_config['section'])
                     if not roster.empty:
                         enrolled = get_enrolled_students(course)
                         with st.form("enrollment_form"):
                             st.write(f"Select students for **{course['course_name']}**.")
-                            options = roster.set_index('student_id')['name'].to_dict()
-                            sel_ids = st.multiselect("Enrolled Students", options.keys(), default=enrolled, format_func=lambda id: f"{options.get(id, 'Unknown')} ({id})")
+                            id_to_label = get_roster_options(class_config['department_id'], class_config['class_name'], class_config['section'])
+                            sel_ids = st.multiselect("Enrolled Students", id_to_label.keys(), default=enrolled, format_func=lambda id: id_to_label.get(id, f"Unknown ({id})"))
                             if st.form_submit_button("Update Enrollment"):
                                 try:
                                     update_course_enrollment(course, sel_ids)
@@ -469,9 +618,9 @@ with tab_admin:
                 sub_tab1, sub_tab2 = st.tabs(["Download Templates", "Upload Data"])
                 with sub_tab1:
                     c1, c2, c3 = st.columns(3)
-                    c1.download_button("⬇️ Students", pd.DataFrame({'student_id':['S001'],'PRN':['1'],'name':['John Doe']}).to_csv(index=False).encode(), 'students_template.csv', use_container_width=True)
-                    c2.download_button("⬇️ Faculty", pd.DataFrame({'faculty_id':['F001'],'name':['Dr. Alan Turing'],'phone_number':['9876543210']}).to_csv(index=False).encode(), 'faculty_template.csv', use_container_width=True)
-                    c3.download_button("⬇️ Courses", pd.DataFrame({'course_code':['CS101'],'course_name':['Intro to Code'],'assigned_faculty_id':['F001']}).to_csv(index=False).encode(), 'courses_template.csv', use_container_width=True)
+                    c1.download_button("⬇️ Students", STUDENTS_TEMPLATE_BYTES, 'students_template.csv', use_container_width=True)
+                    c2.download_button("⬇️ Faculty", FACULTY_TEMPLATE_BYTES, 'faculty_template.csv', use_container_width=True)
+                    c3.download_button("⬇️ Courses", COURSES_TEMPLATE_BYTES, 'courses_template.csv', use_container_width=True)
                 with sub_tab2:
                     st.info(f"New records will be added to: **{class_config['department_name']} / {class_config['class_name']} / {class_config['section']}**")
                     upload_type = st.radio("Select data type to upload:", ["Students", "Faculty", "Courses"])
@@ -479,24 +628,29 @@ with tab_admin:
                     if st.button(f"Process {upload_type} Upload"):
                         if uploaded_file:
                             try:
-                                df = pd.read_csv(uploaded_file); df.fillna('', inplace=True)
                                 id_col_map = {"Students": "student_id", "Faculty": "faculty_id", "Courses": "course_code"}
                                 id_col = id_col_map.get(upload_type)
-                                if id_col and id_col in df.columns and df[id_col].duplicated().any():
-                                    duplicates = df[df[id_col].duplicated()][id_col].astype(str).tolist()
+                                # Type the ID column as text at parse time so leading zeros survive.
+                                tbl = pa_csv.read_csv(uploaded_file, convert_options=pa_csv.ConvertOptions(column_types={id_col: pa.string()}))
+                                df = tbl.to_pandas(types_mapper=pd.ArrowDtype)
+                                dup_mask = df[id_col].duplicated(keep=False) if id_col in df.columns else None
+                                if dup_mask is not None and dup_mask.any():
+                                    duplicates = df.loc[dup_mask, id_col].unique().tolist()
                                     st.error(f"Upload failed. Duplicate IDs found: {', '.join(duplicates)}")
                                     st.stop()
                                 table = upload_type.lower()
-                                records = df.to_dict('records')
+                                base = {}
                                 if table != 'faculty':
-                                    for r in records: r.update({'department_id': class_config['department_id']})
+                                    base['department_id'] = class_config['department_id']
                                     if table in ['students', 'courses']:
-                                        for r in records: r.update({'class_name': class_config['class_name'], 'section': class_config['section']})
+                                        base.update({'class_name': class_config['class_name'], 'section': class_config['section']})
+                                records = pa.Table.from_pandas(df.assign(**base), preserve_index=False).to_pylist()
                                 with st.spinner(f"Uploading {len(df)} records to '{table}'..."):
-                                    supabase.table(table).upsert(records).execute()
-                                    st.toast(f"Uploaded {len(df)} records.", icon="🎉"); st.rerun()
-                                    if table == 'students': load_roster.clear(); get_sections_for_class.clear()
-                                    if table == 'courses': get_courses.clear()
+                                    try:
+                                        upsert_in_batches(table, records, batch_size=1000, max_workers=8)
+                                        st.toast(f"Uploaded {len(df)} records.", icon="🎉"); st.rerun()
+                                    except PartialWriteError as e: st.error(f"Partial upload: {e}. Re-uploading the same file is safe; rows are upserted by ID.")
+                                    finally: invalidate(table)
                             except Exception as e: st.error(f"Error: {e}")
                         else: st.warning("Please upload a file first.")
 
@@ -504,49 +658,46 @@ with tab_admin:
             st.markdown("### 🚨 Class Reports")
             if not class_config: st.info("Select a class at the top to generate reports.")
             else:
-                c1, c2 = st.columns(2)
-                rep_month = c1.selectbox("Report Month", MONTH_NAMES, index=datetime.now().month-1, key="admin_month_select")
-                threshold = c2.number_input("Defaulter Threshold % (<)", 0.0, 100.0, 75.0)
-                if st.button("Generate Report Data", use_container_width=True):
-                    with st.spinner("Fetching report data..."):
-                        try:
-                            response = supabase.rpc('get_detailed_monthly_summary', {'p_department_id': class_config['department_id'], 'p_class_name': class_config['class_name'], 'p_section': class_config['section'], 'p_month_key': month_key(rep_month)}).execute()
-                            st.session_state.detailed_summary_df = pd.DataFrame(response.data)
-                        except Exception as e:
-                            st.error(f"Failed to generate report: {e}"); st.session_state.detailed_summary_df = None
-                if 'detailed_summary_df' in st.session_state and st.session_state.detailed_summary_df is not None:
-                    summary_df = st.session_state.detailed_summary_df
-                    if summary_df.empty: st.warning("No attendance data found for the selected month.")
+                with st.form("class_report_form"):
+                    c1, c2 = st.columns(2)
+                    rep_month = c1.selectbox("Report Month", MONTH_NAMES, index=datetime.now().month-1, key="admin_month_select")
+                    threshold = c2.number_input("Defaulter Threshold % (<)", 0.0, 100.0, 75.0)
+                    generate = st.form_submit_button("Generate Report Data", use_container_width=True)
+                if generate:
+                    st.session_state.class_report_key = (class_config['department_id'], class_config['class_name'], class_config['section'], month_key(rep_month))
+                if st.session_state.get('class_report_key'):
+                    try:
+                        with st.spinner("Fetching report data..."):
+                            pivot_df, totals_df = get_class_report(*st.session_state.class_report_key)
+                    except Exception as e:
+                        st.error(f"Failed to generate report: {e}"); st.session_state.class_report_key = None
                     else:
-                        st.markdown("#### Course-Wise Monthly Summary")
-                        pivot_df = summary_df.pivot_table(index=['PRN', 'name'], columns='course_name', values='attended', aggfunc='first').reset_index().fillna('-')
-                        lectures_map = summary_df.groupby('course_name')['lectures_held'].first()
-                        new_column_names = {col: f"{col} ({lectures_map.get(col, 0)})" for col in pivot_df.columns if col not in ['PRN', 'name']}
-                        pivot_df.rename(columns=new_column_names, inplace=True)
-                        st.dataframe(pivot_df, use_container_width=True)
-                        st.download_button("⬇️ Download Summary", export_excel_file(pivot_df, f"Summary-{class_config['section']}-{rep_month}", "Summary", "#1E40AF"), f"Summary_{class_config['section']}_{rep_month}.xlsx", use_container_width=True)
-                        st.markdown("#### Defaulter List (Overall %)")
-                        agg_df = summary_df.groupby(['student_id', 'PRN', 'name']).agg(total_held=('lectures_held', 'sum'), total_attended=('attended', 'sum')).reset_index()
-                        agg_df['percent'] = agg_df.apply(lambda r: (r['total_attended'] / r['total_held'] * 100) if r['total_held'] > 0 else 0, axis=1)
-                        defaulters_df = agg_df[agg_df['percent'] < threshold].copy()
-                        if defaulters_df.empty: st.success(f"No defaulters found below {threshold}%.")
+                        if pivot_df.empty: st.warning("No attendance data found for the selected month.")
                         else:
-                            st.dataframe(defaulters_df, use_container_width=True)
-                            st.download_button("⬇️ Download Defaulter List", export_excel_file(defaulters_df, f"Defaulters-{class_config['section']}-{rep_month}", "Defaulters", "#B91C1C"), f"Defaulters_{class_config['section']}_{rep_month}.xlsx", use_container_width=True)
+                            st.markdown("#### Course-Wise Monthly Summary")
+                            st.dataframe(pivot_df, use_container_width=True)
+                            st.download_button("⬇️ Download Summary", export_excel_file(pivot_df, f"Summary-{class_config['section']}-{rep_month}", "Summary", "#1E40AF"), f"Summary_{class_config['section']}_{rep_month}.xlsx", use_container_width=True)
+                            st.markdown("#### Defaulter List (Overall %)")
+                            defaulters_df = totals_df[totals_df['percent'].to_numpy() < threshold]
+                            if defaulters_df.empty: st.success(f"No defaulters found below {threshold}%.")
+                            else:
+                                st.dataframe(defaulters_df, use_container_width=True)
+                                st.download_button("⬇️ Download Defaulter List", export_excel_file(defaulters_df, f"Defaulters-{class_config['section']}-{rep_month}", "Defaulters", "#B91C1C"), f"Defaulters_{class_config['section']}_{rep_month}.xlsx", use_container_width=True)
 
         with tab_unlock:
             st.markdown("### 🔓 Unlock Locked Attendance")
             if class_config:
                 courses = get_courses(class_config['department_id'], class_config['class_name'], class_config['section'])
                 if not courses.empty:
-                    sel_course = st.selectbox("Course to Unlock", courses.to_dict('records'), format_func=lambda c: f"{c['course_name']} ({c['course_code']})")
+                    course_by_label = {f"{c['course_name']} ({c['course_code']})": c for c in courses.to_dict('records')}
+                    sel_course = course_by_label[st.selectbox("Course to Unlock", list(course_by_label))]
                     sel_month = st.selectbox("Month to Unlock", MONTH_NAMES, index=datetime.now().month-1)
                     if st.button("Check Status", use_container_width=True): st.session_state.unlock_target = {'course': sel_course, 'month': sel_month, 'config': class_config}
                 if 'unlock_target' in st.session_state:
                     target, cfg = st.session_state.unlock_target, st.session_state.unlock_target['config']
                     mk = month_key(target['month'])
                     recs = get_attendance_records(target['course']['course_code'], mk, cfg['department_id'], cfg['class_name'], cfg['section'])
-                    if not recs.empty and STATUS_LOCKED in recs['status'].unique():
+                    if not recs.empty and (recs['status'].to_numpy() == STATUS_LOCKED).any():
                         st.success(f"Status for {target['course']['course_name']} ({target['month']}) is **LOCKED**.")
                         if st.button("🔓 Unlock These Records", type="primary"): st.session_state.confirm_unlock = True
                     elif not recs.empty: st.info(f"Records are already in {STATUS_DRAFT} state.")
@@ -559,10 +710,10 @@ with tab_admin:
                         target, cfg = st.session_state.unlock_target, st.session_state.unlock_target['config']
                         mk = month_key(target['month'])
                         with st.spinner("Unlocking records..."):
-                            supabase.table('attendance').update({'status': STATUS_DRAFT}).match({'course_code': target['course']['course_code'], 'month_yyyy_mm': mk, 'department_id': cfg['department_id'], 'class_name': cfg['class_name'], 'section': cfg['section']}).execute()
+                            supabase.table('attendance').update({'status': STATUS_DRAFT, 'updated_at': datetime.utcnow().isoformat()}).match({'course_code': target['course']['course_code'], 'month_yyyy_mm': mk, 'department_id': cfg['department_id'], 'class_name': cfg['class_name'], 'section': cfg['section']}).execute()
                             log_action(st.session_state.get("admin_user"), "UNLOCK_ATTENDANCE", {'course': target['course']['course_code'], 'month': mk})
                             st.toast("✅ Unlocked!")
-                        get_attendance_records.clear(); del st.session_state['unlock_target']; del st.session_state['confirm_unlock']; st.rerun()
+                        invalidate('attendance'); del st.session_state['unlock_target']; del st.session_state['confirm_unlock']; st.rerun()
                     except Exception as e: st.error(f"Failed to unlock: {e}")
                 if cu2.button("Cancel"): del st.session_state['confirm_unlock']; st.rerun()
 
@@ -580,26 +731,39 @@ with tab_admin:
                             else: st.error("Incorrect password.")
                     else:
                         st.success("Danger Zone is UNLOCKED.")
-                        if st.button("🔒 Lock Danger Zone"): lock_danger_zone(); st.rerun()
+                        if st.button("🔒 Lock Danger Zone"): lock_danger_zone(); st.session_state.pop('confirm_reset', None); st.rerun()
                         st.error("The following actions are permanent and cannot be undone.", icon="🚨")
-                        if st.button("Permanently Delete All Students", type="primary", disabled=not is_danger_unlocked()):
+                        if st.button("Permanently Delete All Students", type="primary"):
                             try:
-                                supabase.table('students').delete().neq('student_id', 'DO_NOT_DELETE').execute()
+                                supabase.table('students').delete(returning='minimal').neq('student_id', 'DO_NOT_DELETE').execute()
                                 log_action(st.session_state.get("admin_user"), "DANGER_ZONE_DELETE", {'table': 'students'})
-                                st.toast("All student records deleted.", icon="🚨"); load_roster.clear(); st.rerun()
+                                st.toast("All student records deleted.", icon="🚨"); invalidate('students', 'enrollment', 'attendance'); st.rerun()
                             except Exception as e: st.error(f"Error: {e}")
-                        if st.button("Permanently Delete All Faculty", type="primary", disabled=not is_danger_unlocked()):
+                        if st.button("Permanently Delete All Faculty", type="primary"):
                             try:
-                                supabase.table('faculty').delete().neq('faculty_id', 'DO_NOT_DELETE').execute()
+                                supabase.table('faculty').delete(returning='minimal').neq('faculty_id', 'DO_NOT_DELETE').execute()
                                 log_action(st.session_state.get("admin_user"), "DANGER_ZONE_DELETE", {'table': 'faculty'})
-                                st.toast("All faculty records deleted.", icon="🚨"); st.rerun()
+                                st.toast("All faculty records deleted.", icon="🚨"); invalidate('faculty'); st.rerun()
                             except Exception as e: st.error(f"Error: {e}")
-                        if st.button("Permanently Delete All Courses", type="primary", disabled=not is_danger_unlocked()):
+                        if st.button("Permanently Delete All Courses", type="primary"):
                             try:
-                                supabase.table('courses').delete().neq('course_code', 'DO_NOT_DELETE').execute()
+                                supabase.table('courses').delete(returning='minimal').neq('course_code', 'DO_NOT_DELETE').execute()
                                 log_action(st.session_state.get("admin_user"), "DANGER_ZONE_DELETE", {'table': 'courses'})
-                                st.toast("All course records deleted.", icon="🚨"); get_courses.clear(); st.rerun()
+                                st.toast("All course records deleted.", icon="🚨"); invalidate('courses', 'enrollment', 'attendance'); st.rerun()
                             except Exception as e: st.error(f"Error: {e}")
+                        if st.button("Permanently Delete All Students, Faculty & Courses", type="primary"): st.session_state.confirm_reset = True
+                        if st.session_state.get('confirm_reset'):
+                            st.warning("This deletes every student, faculty and course record in one go. Are you sure?", icon="⚠️")
+                            cr1, cr2, _ = st.columns([1,1,3])
+                            if cr1.button("Yes, Delete Everything", type="primary"):
+                                del st.session_state['confirm_reset']
+                                try:
+                                    tables = ['students', 'faculty', 'courses']
+                                    supabase.rpc('reset_tables', {'p_which': tables}).execute()
+                                    log_action(st.session_state.get("admin_user"), "DANGER_ZONE_DELETE", {'tables': tables})
+                                    st.toast("All student, faculty and course records deleted.", icon="🚨"); invalidate(*tables, 'enrollment', 'attendance'); st.rerun()
+                                except Exception as e: st.error(f"Error: {e}")
+                            if cr2.button("Cancel", key="cancel_reset"): del st.session_state['confirm_reset']; st.rerun()
 
 # Footer
 st.divider()
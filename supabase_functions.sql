@@ -0,0 +1,117 @@
+-- SGU Monthly Attendance — database functions called from app_database.py via supabase.rpc(), plus supporting indexes.
+-- Run in the Supabase SQL editor (safe to re-run; every definition uses CREATE OR REPLACE / IF NOT EXISTS).
+
+-- Distinct sections for a department/class, used by the class configuration picker.
+CREATE OR REPLACE FUNCTION distinct_sections(p_dept int, p_class text)
+RETURNS SETOF text
+LANGUAGE sql STABLE AS $$
+    SELECT DISTINCT section FROM students
+    WHERE department_id = p_dept AND class_name = p_class
+    ORDER BY 1
+$$;
+
+-- Faculty login: matches the PIN (last 4 digits of the phone number) server-side so the phone never reaches the app.
+CREATE OR REPLACE FUNCTION verify_faculty_pin(p_fid text, p_pin text)
+RETURNS TABLE(faculty_id text, name text, email text)
+LANGUAGE sql STABLE SECURITY DEFINER
+SET search_path = public, pg_temp AS $$
+    SELECT f.faculty_id, f.name, f.email FROM public.faculty f
+    WHERE f.faculty_id = p_fid AND length(f.phone_number::text) >= 4 AND right(f.phone_number::text, 4) = p_pin
+$$;
+
+-- Faculty dashboard: every course assigned to p_fid, one row per recent month that has attendance
+-- (month_yyyy_mm/status are NULL for courses with none). Any LOCKED row marks the month LOCKED.
+CREATE OR REPLACE FUNCTION faculty_dashboard(p_fid text, p_months text[])
+RETURNS TABLE(course_code text, course_name text, department_id int, department_name text, class_name text, section text, month_yyyy_mm text, status text)
+LANGUAGE sql STABLE AS $$
+    SELECT c.course_code, c.course_name, c.department_id, coalesce(d.name, 'N/A'), c.class_name, c.section, a.month_yyyy_mm, max(a.status)
+    FROM courses c
+    LEFT JOIN departments d ON d.id = c.department_id
+    LEFT JOIN attendance a
+        ON (a.course_code, a.department_id, a.class_name, a.section) = (c.course_code, c.department_id, c.class_name, c.section)
+        AND a.month_yyyy_mm = ANY(p_months)
+    WHERE c.assigned_faculty_id = p_fid
+    GROUP BY c.course_code, c.course_name, c.department_id, d.name, c.class_name, c.section, a.month_yyyy_mm
+    ORDER BY c.course_code, c.section
+$$;
+
+-- Idempotent department insert: returns true when a row was created, NULL when it already existed.
+CREATE OR REPLACE FUNCTION add_department(p_name text)
+RETURNS boolean
+LANGUAGE sql AS $$
+    INSERT INTO departments(name) VALUES (p_name)
+    ON CONFLICT (name) DO NOTHING
+    RETURNING true
+$$;
+
+-- Section placeholder: 'created' on insert, 'exists' when the department/class already has this section,
+-- 'id_taken' when p_student_id belongs to some other row. The return type changed from boolean, hence the DROP.
+DROP FUNCTION IF EXISTS add_section_placeholder(text, int, text, text);
+CREATE FUNCTION add_section_placeholder(p_student_id text, p_dept int, p_class text, p_section text)
+RETURNS text
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM students WHERE department_id = p_dept AND class_name = p_class AND section = p_section) THEN
+        RETURN 'exists';
+    END IF;
+    INSERT INTO students(student_id, "PRN", name, department_id, class_name, section, is_active)
+    VALUES (p_student_id, p_student_id, 'Admin Placeholder', p_dept, p_class, p_section, false)
+    ON CONFLICT (student_id) DO NOTHING;
+    RETURN CASE WHEN FOUND THEN 'created' ELSE 'id_taken' END;
+END
+$$;
+
+-- Replace a course's enrollment list in one call; the function runs as a single transaction,
+-- so a failed insert leaves the previous enrollment intact.
+CREATE OR REPLACE FUNCTION set_enrollment(p_course_code text, p_dept int, p_class text, p_section text, p_student_ids text[])
+RETURNS void
+LANGUAGE sql AS $$
+    DELETE FROM student_course_enrollment
+    WHERE course_code = p_course_code AND department_id = p_dept AND class_name = p_class AND section = p_section;
+    INSERT INTO student_course_enrollment(course_code, department_id, class_name, section, student_id)
+    SELECT p_course_code, p_dept, p_class, p_section, sid FROM unnest(p_student_ids) AS sid;
+$$;
+
+-- Danger Zone reset: deletes every row except the DO_NOT_DELETE sentinels from each table named in
+-- p_which, all in one transaction (courses first, since they reference faculty).
+-- SECURITY INVOKER, so it runs with the caller's own table privileges and RLS, the same ones the
+-- per-table Danger Zone deletes already use; EXECUTE is granted to the roles the app's key may map to.
+CREATE OR REPLACE FUNCTION reset_tables(p_which text[])
+RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF 'courses' = ANY(p_which) THEN DELETE FROM public.courses WHERE course_code <> 'DO_NOT_DELETE'; END IF;
+    IF 'students' = ANY(p_which) THEN DELETE FROM public.students WHERE student_id <> 'DO_NOT_DELETE'; END IF;
+    IF 'faculty' = ANY(p_which) THEN DELETE FROM public.faculty WHERE faculty_id <> 'DO_NOT_DELETE'; END IF;
+END
+$$;
+GRANT EXECUTE ON FUNCTION reset_tables(text[]) TO anon, authenticated, service_role;
+
+-- Admin class report, built on the existing get_detailed_monthly_summary(...) rows, in one pass:
+-- one row per student with `courses` mapping 'Course name (lectures held)' -> attended, plus the
+-- student's overall totals and percent for the month (the app filters defaulters on `percent`).
+CREATE OR REPLACE FUNCTION get_class_report(p_department_id int, p_class_name text, p_section text, p_month_key text)
+RETURNS TABLE(student_id text, "PRN" text, name text, courses jsonb, total_held bigint, total_attended bigint, percent numeric)
+LANGUAGE sql STABLE AS $$
+    WITH s AS (
+        SELECT * FROM get_detailed_monthly_summary(p_department_id, p_class_name, p_section, p_month_key)
+    ), held AS (
+        SELECT DISTINCT ON (course_name) course_name, lectures_held FROM s ORDER BY course_name
+    )
+    SELECT s.student_id::text, s."PRN"::text, s.name::text,
+           jsonb_object_agg(s.course_name || ' (' || coalesce(h.lectures_held, 0) || ')', s.attended),
+           sum(s.lectures_held)::bigint, sum(s.attended)::bigint,
+           coalesce(sum(s.attended) * 100.0 / nullif(sum(s.lectures_held), 0), 0)
+    FROM s JOIN held h USING (course_name)
+    GROUP BY s.student_id, s."PRN", s.name
+    ORDER BY s."PRN", s.name
+$$;
+
+-- Composite indexes matching the .eq() chains in get_attendance_records and get_enrolled_students,
+-- and the month/updated_at lookup in get_attendance_data_version, so each lookup is a single index seek. Check with EXPLAIN ANALYZE after creating.
+CREATE INDEX IF NOT EXISTS idx_attendance_lookup
+    ON attendance (course_code, department_id, class_name, section, month_yyyy_mm);
+CREATE INDEX IF NOT EXISTS idx_attendance_version
+    ON attendance (month_yyyy_mm, updated_at);
+CREATE INDEX IF NOT EXISTS idx_enrollment_lookup
+    ON student_course_enrollment (course_code, department_id, class_name, section);